@@ -1,64 +1,259 @@
+import argparse
+import asyncio
+import getpass
+import hashlib
 import json
 import os
+import shutil
+import signal
 import sys
+import tempfile
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Optional, Tuple
 
-try:
-    # Attempt to import Google GenAI SDK and Rich library
-    from google import genai
-    from google.genai.errors import APIError
-    from rich.console import Console
-    from rich.markdown import Markdown
-    from rich.panel import Panel
-    from rich.prompt import Prompt
-except ImportError:
+def _missing_dependencies():
+    """Explains how to install the required libraries and exits."""
     print("Error: Required libraries not found.")
     print("Please install them using: pip install google-genai rich")
     sys.exit(1)
 
+try:
+    # Only the console is needed up front; the heavier imports are deferred until first use
+    from rich.console import Console
+except ImportError:
+    _missing_dependencies()
+
+try:
+    # orjson is optional; it parses and serializes the config and history much faster than json
+    import orjson
+except ImportError:
+    orjson = None
+
+_genai = None
+
+def _get_genai():
+    """Imports the Google GenAI SDK on first use, keeping it off the CLI startup path."""
+    global _genai
+    if _genai is None:
+        try:
+            from google import genai
+        except ImportError:
+            _missing_dependencies()
+        _genai = genai
+    return _genai
+
 # --- Configuration and Setup ---
 APP_NAME = "Comp.lex"
 CONFIG_PATH = Path.home() / ".complex_config.json"
+HISTORY_PATH = Path.home() / ".complex_history.jsonl"
+CACHE_DIR = Path.home() / ".complex_cache"
 DEFAULT_MODEL = "gemini-2.5-flash"
+DEFAULT_MAX_CONTEXT = 20  # most recent history messages sent with each chat
+MAX_HISTORY_TOKENS = 500_000  # estimated tokens of history sent with a chat before the oldest messages are dropped
+API_MAX_ATTEMPTS = 3  # tries per request before a transient API error is reported
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503}
+ASK_MANY_CONCURRENCY = 10  # max in-flight requests for /ask-many
+STREAM_FLUSH_INTERVAL = 0.03  # seconds between terminal flushes while streaming
+BATCH_POLL_INTERVAL = 10  # seconds between batch job status checks
+BATCH_DONE_STATES = {"JOB_STATE_SUCCEEDED", "JOB_STATE_FAILED", "JOB_STATE_CANCELLED", "JOB_STATE_EXPIRED"}
 
 # Initialize rich console for beautiful output
 console = Console()
 
+def _json_loads(data: bytes) -> Any:
+    """Parses JSON with orjson when available, falling back to the standard library."""
+    return orjson.loads(data) if orjson else json.loads(data)
+
+def _json_line(obj: Any) -> bytes:
+    """Serializes obj as a single newline-terminated JSON line."""
+    return orjson.dumps(obj) + b"\n" if orjson else (json.dumps(obj) + "\n").encode("utf-8")
+
 def load_config() -> Dict[str, Any]:
-    """Loads configuration and history from the config file."""
+    """Loads settings from the config file."""
     if CONFIG_PATH.exists():
         try:
-            with open(CONFIG_PATH, 'r') as f:
-                return json.load(f)
+            config = _json_loads(CONFIG_PATH.read_bytes())
         except json.JSONDecodeError:
             console.print(f"[bold yellow]Warning:[/bold yellow] Configuration file corrupted. Starting fresh.")
             return {}
+
+        # Older versions kept the history inside the config file; move it to the history file
+        if "history" in config:
+            legacy_history = config["history"]
+            if HISTORY_PATH.exists() or rewrite_history([message["role"] for message in legacy_history], [message["text"] for message in legacy_history]):
+                # Drop it from the config right away, or every start would migrate it again
+                del config["history"]
+                save_config(config)
+        return config
     return {}
 
-def save_config(config: Dict[str, Any]):
-    """Saves configuration and history to the config file."""
+def save_config(config: Dict[str, Any]) -> bool:
+    """Saves settings to the config file and returns whether the write succeeded."""
     try:
-        with open(CONFIG_PATH, 'w') as f:
-            json.dump(config, f, indent=4)
+        if orjson:
+            CONFIG_PATH.write_bytes(orjson.dumps(config, option=orjson.OPT_INDENT_2))
+        else:
+            with open(CONFIG_PATH, 'w') as f:
+                json.dump(config, f, indent=4)
+        return True
     except IOError as e:
         console.print(f"[bold red]Error:[/bold red] Could not save configuration: {e}")
+        return False
+
+def token_estimate(text: str) -> int:
+    """Roughly estimates the token count of text (about four characters per token for Gemini)."""
+    return (len(text) + 3) // 4
+
+def load_history() -> Tuple[List[str], List[str]]:
+    """Loads chat history from the history file, one message per line, as parallel role and text lists."""
+    roles, texts = [], []
+    if not HISTORY_PATH.exists():
+        return roles, texts
+
+    data = HISTORY_PATH.read_bytes()
+    skipped = 0
+    for line in data.splitlines():
+        if not line.strip():
+            continue
+        # A torn append only damages its own line, so skip it and keep reading
+        try:
+            message = _json_loads(line)
+        except ValueError:
+            skipped += 1
+            continue
+        if not isinstance(message, dict) or not isinstance(message.get("role"), str) or not isinstance(message.get("text"), str):
+            skipped += 1
+            continue
+        roles.append(message["role"])
+        texts.append(message["text"])
+
+    # Rewrite a damaged file, or one whose last line lacks its newline, so the next append starts on a fresh line
+    if skipped or (data and not data.endswith(b"\n")):
+        if skipped:
+            console.print(f"[bold yellow]Warning:[/bold yellow] History file corrupted. Skipped {skipped} unreadable lines.")
+        rewrite_history(roles, texts)
+    return roles, texts
+
+def append_history(roles: List[str], texts: List[str]):
+    """Appends messages to the history file without rewriting what is already there."""
+    try:
+        with open(HISTORY_PATH, 'a+b') as f:
+            # If an earlier append was cut short, start on a fresh line so only the torn line is lost
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+            f.writelines(_json_line({"role": role, "text": text}) for role, text in zip(roles, texts))
+    except IOError as e:
+        console.print(f"[bold red]Error:[/bold red] Could not save history: {e}")
+
+def rewrite_history(roles: List[str], texts: List[str]) -> bool:
+    """Replaces the whole history file with the given messages and returns whether the write succeeded."""
+    try:
+        with open(HISTORY_PATH, 'wb') as f:
+            f.writelines(_json_line({"role": role, "text": text}) for role, text in zip(roles, texts))
+        return True
+    except IOError as e:
+        console.print(f"[bold red]Error:[/bold red] Could not save history: {e}")
+        return False
+
+def response_cache_key(model: str, temperature: float, system_instruction: str, context: Iterable[Tuple[str, str]], prompt: str) -> str:
+    """Hashes everything that determines a deterministic (temperature 0) response."""
+    context_text = "\n".join(f"{role}: {text}" for role, text in context)
+    return hashlib.blake2b(f"{model}|{temperature}|{system_instruction}|{context_text}|{prompt}".encode("utf-8")).hexdigest()
+
+def _cache_path(key: str) -> Path:
+    # Fan out into subdirectories so no single directory grows too large
+    return CACHE_DIR / key[:2] / key
+
+def load_cached_response(key: str) -> Optional[str]:
+    """Returns the cached response for key, or None on a cache miss."""
+    try:
+        return _cache_path(key).read_text(encoding="utf-8")
+    except (FileNotFoundError, IOError):
+        return None
+
+def store_cached_response(key: str, text: str):
+    """Saves a response to the on-disk cache."""
+    path = _cache_path(key)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(text, encoding="utf-8")
+    except IOError as e:
+        console.print(f"[bold red]Error:[/bold red] Could not cache response: {e}")
+
+def clear_response_cache():
+    """Deletes every cached response."""
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+# Static panels are built once, on first use; their markup is parsed into Text up front so
+# Rich doesn't re-parse it every time the panel is printed
+_WELCOME_PANEL = None
+_HELP_PANEL = None
+
+def _get_welcome_panel():
+    """Returns the first-run setup panel."""
+    global _WELCOME_PANEL
+    if _WELCOME_PANEL is None:
+        from rich.panel import Panel
+        from rich.text import Text
+
+        _WELCOME_PANEL = Panel(Text.from_markup(
+            "[bold white]Welcome to Comp.lex[/bold white] (Complex AI for the Command Line)\n\n"
+            "This application uses the Gemini API. Your API key will be saved locally in "
+            f"[bold cyan]{CONFIG_PATH}[/bold cyan] and is [bold red]never[/bold red] transmitted to anyone but Google.\n\n"
+            "[bold green]Instructions to get your key:[/bold green]\n"
+            "1. Visit the Google AI Studio to get an API key."
+            ), title=Text.from_markup(f"[bold green]{APP_NAME} Setup[/bold green]"), border_style="cyan"
+        )
+    return _WELCOME_PANEL
+
+def _get_help_panel():
+    """Returns the /help command panel."""
+    global _HELP_PANEL
+    if _HELP_PANEL is None:
+        from rich.panel import Panel
+        from rich.text import Text
+
+        _HELP_PANEL = Panel(Text.from_markup(
+            "[bold cyan]Available Commands:[/bold cyan]\n"
+            "[bold green]/model <name> [/bold green]- Switch model (e.g., flash, pro, gemini-2.5-flash).\n"
+            "[bold green]/temp <0.0-1.0> [/bold green]- Set response creativity (e.g., /temp 0.9).\n"
+            "[bold green]/persona <prompt> [/bold green]- Set the AI's role/system instruction (e.g., /persona Act as a Linux expert).\n"
+            "[bold green]/search on/off [/bold green]- Toggle Google Search grounding for up-to-date info.\n"
+            "[bold green]/context <n> [/bold green]- Send only the last n history messages as context (e.g., /context 10).\n"
+            "[bold green]/history clear [/bold green]- Clear current chat history.\n"
+            "[bold green]/cache clear [/bold green]- Delete cached responses (used when temperature is 0.0).\n"
+            "[bold green]/ask-many <n> [/bold green]- Enter n prompts and send them all concurrently.\n"
+            "[bold green]/settings [/bold green]- Display current settings.\n"
+            "[bold green]/exit [/bold green]- Quit the application and save history."
+            ), title=Text.from_markup("[bold magenta]Help Menu[/bold magenta]"), border_style="magenta"
+        )
+    return _HELP_PANEL
+
+def ask_input(prompt: str) -> str:
+    """Reads a line with Prompt.ask, letting Ctrl-C raise KeyboardInterrupt even under asyncio.run."""
+    from rich.prompt import Prompt
+
+    # asyncio.run replaces the SIGINT handler with one that cancels the main task, which would
+    # leave the blocking read to fail with EOFError instead; restore the default while reading
+    previous_handler = signal.signal(signal.SIGINT, signal.default_int_handler)
+    try:
+        return Prompt.ask(prompt)
+    finally:
+        signal.signal(signal.SIGINT, previous_handler)
 
 def get_api_key(config: Dict[str, Any]) -> str:
     """Prompts the user for an API key if it's not in the config."""
+    from rich.prompt import Prompt
+
     api_key = config.get("api_key")
     
     # Check if API key is present but invalid (e.g., placeholder)
     if not api_key or not api_key.startswith("AIza"):
-        console.print(Panel(
-            "[bold white]Welcome to Comp.lex[/bold white] (Complex AI for the Command Line)\n\n"
-            "This application uses the Gemini API. Your API key will be saved locally in "
-            f"[bold cyan]{CONFIG_PATH}[/bold cyan] and is [bold red]never[/bold red] transmitted to anyone but Google.\n\n"
-            "[bold green]Instructions to get your key:[/bold green]\n"
-            "1. Visit the Google AI Studio to get an API key."
-            , title=f"[bold green]{APP_NAME} Setup[/bold green]", border_style="cyan"
-        ))
+        console.print(_get_welcome_panel())
         
         # Keep prompting until a key is provided
         while True:
@@ -83,210 +278,559 @@ class ComplexChat:
         self.temperature = config.get("temperature", 0.7)
         self.system_instruction = config.get("system_instruction", "You are a concise, helpful assistant named Comp.lex, specialized in technical advice, coding, and developer tasks. Format all code responses in markdown code blocks.")
         self.search_grounding = config.get("search_grounding", False)
-        self.history: List[Dict[str, str]] = config.get("history", [])
+        try:
+            self._user = os.getlogin()
+        except OSError:
+            # No controlling terminal (e.g. --batch from cron); fall back to the environment
+            self._user = getpass.getuser()
+        self._refresh_prompt()
+        # History is kept as two parallel lists rather than a dict per message
+        self._roles, self._texts = load_history()
+        # Number of leading history messages already written to HISTORY_PATH
+        self._persisted = len(self._texts)
+        # Disk writes run on a single worker thread, so they start at once and land in order
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="complex-writer")
+        self._write_future = None
+        # True while self.config has changes that have not reached CONFIG_PATH yet; the version
+        # counts settings changes so an older save finishing late doesn't clear the flag
+        self._dirty = False
+        self._settings_version = 0
+        self.max_context = config.get("max_context", DEFAULT_MAX_CONTEXT)
+        self.max_history_tokens = config.get("max_history_tokens", MAX_HISTORY_TOKENS)
+        # Index of the oldest message still sent as context, and the estimated tokens from there on
+        self._context_start = 0
+        self._context_tokens = sum(token_estimate(text) for text in self._texts)
+        self._trim_context()
+
+        # genai.types.Content form of the messages from _contents_start on, filled in by _context_window
+        self._contents_start = len(self._texts)
+        self._contents_cache = []
+        self._session_start = 0
 
         if self.api_key:
-            self.client = genai.Client(api_key=self.api_key)
+            self.client = _get_genai().Client(api_key=self.api_key)
         else:
             self.client = None # Will be set after key input
 
         self.chat_session = self._create_new_chat()
 
+        # Slash command dispatch table; each handler takes the argument text and returns True to exit
+        self._commands = {
+            "/exit": self._cmd_exit,
+            "/quit": self._cmd_exit,
+            "/help": self._cmd_help,
+            "/settings": self._cmd_settings,
+            "/model": self._cmd_model,
+            "/temp": self._cmd_temp,
+            "/context": self._cmd_context,
+            "/persona": self._cmd_persona,
+            "/search": self._cmd_search,
+            "/history": self._cmd_history,
+            "/cache": self._cmd_cache,
+            "/ask-many": self._cmd_ask_many,
+        }
+
+    @staticmethod
+    def _to_content(role: str, text: str):
+        """Wraps a single history message as a genai.types.Content."""
+        genai = _get_genai()
+        return genai.types.Content(role=role, parts=[genai.types.Part.from_text(text=text)])
+
+    def _refresh_prompt(self):
+        """Rebuilds the input prompt shown in the chat loop; call whenever model_name changes."""
+        self._prompt_str = f"\n[bold cyan]{self._user}@[/bold cyan][bold magenta]{self.model_name.split('-')[-1].upper()}[/bold magenta]"
+
+    def _append_history(self, role: str, text: str):
+        """Records a message in the history and updates the context token estimate."""
+        self._roles.append(role)
+        self._texts.append(text)
+        self._context_tokens += token_estimate(text)
+        self._trim_context()
+
+    def _trim_context(self):
+        """Drops the oldest messages from the context until it fits within max_history_tokens."""
+        # Dropped messages stay in the history and on disk; they are just no longer sent to the model.
+        # The context must also open with a user turn, so a leading model reply is dropped with its prompt.
+        while self._context_start < len(self._texts) - 1 and (
+            self._context_tokens > self.max_history_tokens
+            or self._roles[self._context_start] != "user"
+        ):
+            self._context_tokens -= token_estimate(self._texts[self._context_start])
+            self._context_start += 1
+
+    def _context_window_start(self) -> int:
+        """Returns the history index where the last max_context messages that fit the token budget begin."""
+        start = max(self._context_start, len(self._texts) - self.max_context)
+        # The context must open with a user turn
+        while start < len(self._roles) and self._roles[start] != "user":
+            start += 1
+        return start
+
+    def _context_window(self) -> list:
+        """Returns the Content for the messages sent as chat context, converting only those not cached yet."""
+        start = self._context_window_start()
+        if start < self._contents_start:
+            # The window reaches further back than before (e.g. a larger /context)
+            self._contents_cache[:0] = [
+                self._to_content(role, text)
+                for role, text in zip(self._roles[start:self._contents_start], self._texts[start:self._contents_start])
+            ]
+        else:
+            # Messages that slid out of the window are never sent again
+            del self._contents_cache[:start - self._contents_start]
+        self._contents_start = start
+        end = start + len(self._contents_cache)
+        self._contents_cache.extend(self._to_content(role, text) for role, text in zip(self._roles[end:], self._texts[end:]))
+        # The chat extends its history list in place, so hand it a copy
+        return self._contents_cache[:]
+
+    def _flush_history(self):
+        """Appends any messages not yet on disk to the history file."""
+        start = self._persisted
+        pending_texts = self._texts[start:]
+        if pending_texts:
+            append_history(self._roles[start:start + len(pending_texts)], pending_texts)
+            self._persisted = start + len(pending_texts)
+
+    def _schedule_write(self, func, *args):
+        """Queues a blocking write on the writer thread, after any write already queued."""
+        self._write_future = asyncio.get_running_loop().run_in_executor(self._writer, func, *args)
+
+    def save(self):
+        """Writes any history and settings that haven't reached disk yet, after queued writes."""
+        self._writer.submit(self._flush_history).result()
+        if self._dirty:
+            self._writer.submit(self._write_settings, self._settings_version, dict(self.config)).result()
+
+    def _write_settings(self, version: int, config: Dict[str, Any]):
+        """Saves a settings snapshot, clearing the dirty flag if no newer change has been made since."""
+        if save_config(config) and version == self._settings_version:
+            self._dirty = False
+
+    def _save_settings(self):
+        """Marks the settings as changed and schedules a background save."""
+        self._dirty = True
+        self._settings_version += 1
+        self._schedule_write(self._write_settings, self._settings_version, dict(self.config))
+
+    @staticmethod
+    def _uncancel():
+        """Withdraws pending cancellation requests on the current task so cleanup can still await."""
+        task = asyncio.current_task()
+        # Task.uncancel only exists (and asyncio.run only cancels on Ctrl-C) from Python 3.11
+        if hasattr(task, "uncancel"):
+            while task.cancelling():
+                task.uncancel()
+
+    async def _drain_writes(self):
+        """Waits for all scheduled background writes to finish."""
+        # The writer runs jobs in order, so the last one finishing means all of them have
+        if self._write_future is not None:
+            await self._write_future
+            self._write_future = None
+
+    def _generation_config(self) -> Dict[str, Any]:
+        """Builds the request config from the current persona, temperature and grounding settings."""
+        return {
+            "system_instruction": self.system_instruction,
+            "temperature": self.temperature,
+            "tools": [{"google_search": {}}] if self.search_grounding else [],
+        }
+
     def _create_new_chat(self):
         """Initializes a new chat session with current settings."""
         if not self.client:
             return None
 
-        # The history needs to be reformatted from simple dict to genai.types.Content
-        contents = [
-            genai.types.Content(
-                role=message["role"],
-                parts=[genai.types.Part.from_text(message["text"])]
-            )
-            for message in self.history
-        ]
-
         # Use gemini-2.5-flash-lite for tools and grounding
         model_to_use = "gemini-2.5-flash-lite" if self.search_grounding else self.model_name
+        # History index of the first message the session holds; it keeps every turn sent after that
+        self._session_start = self._context_window_start()
         
-        chat = self.client.chats.create(
+        chat = self.client.aio.chats.create(
             model=model_to_use,
-            config={
-                "system_instruction": self.system_instruction,
-                "temperature": self.temperature,
-                "tools": [{"google_search": {}}] if self.search_grounding else [],
-            },
-            history=contents
+            config=self._generation_config(),
+            history=self._context_window()
         )
         return chat
 
     def display_settings(self):
         """Displays the current model settings."""
+        from rich.panel import Panel
+
         console.print(Panel(
             f"[bold yellow]Model:[/bold yellow] {self.model_name}\n"
             f"[bold yellow]Temperature:[/bold yellow] {self.temperature:.1f}\n"
             f"[bold yellow]Persona (System Instruction):[/bold yellow] {self.system_instruction}\n"
             f"[bold yellow]Google Search Grounding:[/bold yellow] {'[bold green]ON[/bold green]' if self.search_grounding else '[bold red]OFF[/bold red]'}\n"
-            f"[bold yellow]History Length:[/bold yellow] {len(self.history)} messages"
+            f"[bold yellow]History Length:[/bold yellow] {len(self._texts)} messages\n"
+            f"[bold yellow]Context Window:[/bold yellow] last {self.max_context} messages"
             , title="[bold cyan]Current Settings[/bold cyan]", border_style="yellow"
         ))
 
-    def process_command(self, user_input: str) -> bool:
-        """Handles slash commands and returns True if a command was executed."""
+    async def ask_many(self, prompts: List[str]) -> List[Optional[str]]:
+        """Sends independent prompts concurrently and renders the answers in order; None marks a failed one."""
+        from google.genai.errors import APIError
+        from rich.live import Live
+        from rich.markdown import Markdown
+        from rich.table import Table
+
+        model_to_use = "gemini-2.5-flash-lite" if self.search_grounding else self.model_name
+        config = self._generation_config()
+        semaphore = asyncio.Semaphore(ASK_MANY_CONCURRENCY)
+        responses: List[Optional[str]] = [None] * len(prompts)
+        # What the grid shows for each prompt once it finishes, including errors
+        shown = [None] * len(prompts)
+
+        def render() -> Table:
+            grid = Table.grid(padding=(0, 1))
+            grid.add_column(style="bold cyan", no_wrap=True)
+            grid.add_column()
+            for i, prompt in enumerate(prompts):
+                grid.add_row(f"[{i + 1}]", f"[bold]{prompt}[/bold]")
+                grid.add_row("", shown[i] if shown[i] is not None else "[dim]waiting...[/dim]")
+            return grid
+
+        with Live(render(), console=console, refresh_per_second=8) as live:
+            async def ask(i: int, prompt: str):
+                async with semaphore:
+                    try:
+                        response = await self._with_retries(
+                            lambda: self.client.aio.models.generate_content(
+                                model=model_to_use,
+                                contents=[prompt],
+                                config=config,
+                            )
+                        )
+                        if response.text:
+                            responses[i] = response.text
+                            shown[i] = Markdown(response.text)
+                        else:
+                            shown[i] = "[bold red]No response[/bold red] (the request was blocked or came back empty)."
+                    except APIError as e:
+                        shown[i] = f"[bold red]API Error:[/bold red] [yellow]{e}[/yellow]"
+                live.update(render())
+
+            await asyncio.gather(*(ask(i, p) for i, p in enumerate(prompts)))
+
+        return responses
+
+    async def process_command(self, user_input: str) -> bool:
+        """Handles slash commands and returns True if the chat loop should exit."""
+        # Split off the command at the first whitespace and look up its handler, instead of
+        # splitting the whole input and comparing against every command in turn
         parts = user_input.split(maxsplit=1)
         command = parts[0].lower()
-        arg = parts[1] if len(parts) > 1 else ""
+        arg = parts[1].strip() if len(parts) > 1 else ""
 
-        if command == "/exit" or command == "/quit":
-            console.print(f"\n[bold green]Exiting {APP_NAME}. Goodbye![/bold green]")
-            return True
-        
-        elif command == "/help":
-            console.print(Panel(
-                "[bold cyan]Available Commands:[/bold cyan]\n"
-                "[bold green]/model <name> [/bold green]- Switch model (e.g., flash, pro, gemini-2.5-flash).\n"
-                "[bold green]/temp <0.0-1.0> [/bold green]- Set response creativity (e.g., /temp 0.9).\n"
-                "[bold green]/persona <prompt> [/bold green]- Set the AI's role/system instruction (e.g., /persona Act as a Linux expert).\n"
-                "[bold green]/search on/off [/bold green]- Toggle Google Search grounding for up-to-date info.\n"
-                "[bold green]/history clear [/bold green]- Clear current chat history.\n"
-                "[bold green]/settings [/bold green]- Display current settings.\n"
-                "[bold green]/exit [/bold green]- Quit the application and save history."
-                , title="[bold magenta]Help Menu[/bold magenta]", border_style="magenta"
-            ))
-
-        elif command == "/settings":
-            self.display_settings()
-
-        elif command == "/model":
-            if not arg:
-                console.print("[bold red]Error:[/bold red] Please specify a model name (e.g., /model pro).")
-                return False
-            
-            # Simple mapping for user convenience
-            model_map = {
-                "flash": "gemini-2.5-flash", 
-                "pro": "gemini-2.5-pro",
-                "lite": "gemini-2.5-flash-lite",
-            }
-            new_model = model_map.get(arg.lower(), arg)
-            
-            # Basic validation
-            if not new_model.startswith("gemini"):
-                console.print(f"[bold red]Error:[/bold red] '{arg}' is not a recognized model name. Use gemini-2.5-flash, gemini-2.5-pro, etc.")
-                return False
-
-            self.model_name = new_model
-            self.config["model"] = self.model_name
-            self.chat_session = self._create_new_chat()
-            console.print(f"[bold green]Model changed to:[/bold green] {self.model_name}. Chat restarted.")
+        handler = self._commands.get(command)
+        if handler is None:
+            console.print(f"[bold red]Unknown command:[/bold red] {command}. Use /help for a list of commands.")
+            return False
+        return await handler(arg)
 
-        elif command == "/temp":
-            try:
-                temp = float(arg)
-                if 0.0 <= temp <= 1.0:
-                    self.temperature = temp
-                    self.config["temperature"] = self.temperature
-                    self.chat_session = self._create_new_chat()
-                    console.print(f"[bold green]Temperature set to:[/bold green] {self.temperature}. Chat restarted.")
-                else:
-                    console.print("[bold red]Error:[/bold red] Temperature must be between 0.0 and 1.0.")
-            except ValueError:
-                console.print("[bold red]Error:[/bold red] Invalid temperature value.")
-
-        elif command == "/persona":
-            if not arg:
-                console.print("[bold red]Error:[/bold red] Please provide a persona prompt.")
-                return False
-            self.system_instruction = arg
-            self.config["system_instruction"] = self.system_instruction
-            self.chat_session = self._create_new_chat()
-            console.print(f"[bold green]Persona updated.[/bold green] Chat restarted with new role: '{arg}'")
-
-        elif command == "/search":
-            if arg.lower() in ["on", "true"]:
-                self.search_grounding = True
-                console.print("[bold green]Google Search Grounding ENABLED.[/bold green] Responses will be grounded in current web data. Note: The model will be temporarily set to 'gemini-2.5-flash-lite' when search is enabled to optimize for tool use.")
-            elif arg.lower() in ["off", "false"]:
-                self.search_grounding = False
-                console.print("[bold yellow]Google Search Grounding DISABLED.[/bold yellow] Using primary model for general knowledge.")
+    async def _cmd_exit(self, arg: str) -> bool:
+        """Quits the application."""
+        console.print(f"\n[bold green]Exiting {APP_NAME}. Goodbye![/bold green]")
+        return True
+
+    async def _cmd_help(self, arg: str) -> bool:
+        """Shows the list of commands."""
+        console.print(_get_help_panel())
+        return False
+
+    async def _cmd_settings(self, arg: str) -> bool:
+        """Displays the current settings."""
+        self.display_settings()
+        return False
+
+    async def _cmd_model(self, arg: str) -> bool:
+        """Switches the model and restarts the chat."""
+        if not arg:
+            console.print("[bold red]Error:[/bold red] Please specify a model name (e.g., /model pro).")
+            return False
+
+        # Simple mapping for user convenience
+        model_map = {
+            "flash": "gemini-2.5-flash", 
+            "pro": "gemini-2.5-pro",
+            "lite": "gemini-2.5-flash-lite",
+        }
+        new_model = model_map.get(arg.lower(), arg)
+
+        # Basic validation
+        if not new_model.startswith("gemini"):
+            console.print(f"[bold red]Error:[/bold red] '{arg}' is not a recognized model name. Use gemini-2.5-flash, gemini-2.5-pro, etc.")
+            return False
+
+        if new_model == self.model_name:
+            console.print(f"[bold yellow]Already using:[/bold yellow] {self.model_name}.")
+            return False
+
+        self.model_name = new_model
+        self.config["model"] = self.model_name
+        self._refresh_prompt()
+        self._save_settings()
+        self.chat_session = self._create_new_chat()
+        console.print(f"[bold green]Model changed to:[/bold green] {self.model_name}. Chat restarted.")
+
+        return False
+
+    async def _cmd_temp(self, arg: str) -> bool:
+        """Sets the response temperature."""
+        try:
+            temp = float(arg)
+            if 0.0 <= temp <= 1.0:
+                self.temperature = temp
+                self.config["temperature"] = self.temperature
+                self._save_settings()
+                # Applied per request via _generation_config, so the chat needn't be rebuilt
+                console.print(f"[bold green]Temperature set to:[/bold green] {self.temperature}.")
             else:
-                console.print("[bold red]Error:[/bold red] Use '/search on' or '/search off'.")
-            
-            self.config["search_grounding"] = self.search_grounding
-            self.chat_session = self._create_new_chat() # Recreate chat to apply grounding tool
+                console.print("[bold red]Error:[/bold red] Temperature must be between 0.0 and 1.0.")
+        except ValueError:
+            console.print("[bold red]Error:[/bold red] Invalid temperature value.")
 
-        elif command == "/history":
-            if arg.lower() == "clear":
-                self.history = []
-                self.config["history"] = []
+        return False
+
+    async def _cmd_context(self, arg: str) -> bool:
+        """Sets how many recent history messages are sent as context."""
+        try:
+            max_context = int(arg)
+            if max_context >= 0:
+                self.max_context = max_context
+                self.config["max_context"] = self.max_context
+                self._save_settings()
                 self.chat_session = self._create_new_chat()
-                console.print("[bold yellow]Chat history cleared.[/bold yellow] Chat session restarted.")
+                console.print(f"[bold green]Context window set to:[/bold green] last {self.max_context} messages. Chat restarted.")
             else:
-                console.print("[bold red]Error:[/bold red] Use '/history clear' to clear the conversation history.")
-        
+                console.print("[bold red]Error:[/bold red] Context window must be 0 or more messages.")
+        except ValueError:
+            console.print("[bold red]Error:[/bold red] Invalid context window size.")
+
+        return False
+
+    async def _cmd_persona(self, arg: str) -> bool:
+        """Sets the system instruction."""
+        if not arg:
+            console.print("[bold red]Error:[/bold red] Please provide a persona prompt.")
+            return False
+        self.system_instruction = arg
+        self.config["system_instruction"] = self.system_instruction
+        self._save_settings()
+        # Applied per request via _generation_config, so the chat needn't be rebuilt
+        console.print(f"[bold green]Persona updated.[/bold green] New role: '{arg}'")
+
+        return False
+
+    async def _cmd_search(self, arg: str) -> bool:
+        """Toggles Google Search grounding."""
+        previous_grounding = self.search_grounding
+        if arg.lower() in ["on", "true"]:
+            self.search_grounding = True
+            console.print("[bold green]Google Search Grounding ENABLED.[/bold green] Responses will be grounded in current web data. Note: The model will be temporarily set to 'gemini-2.5-flash-lite' when search is enabled to optimize for tool use.")
+        elif arg.lower() in ["off", "false"]:
+            self.search_grounding = False
+            console.print("[bold yellow]Google Search Grounding DISABLED.[/bold yellow] Using primary model for general knowledge.")
         else:
-            console.print(f"[bold red]Unknown command:[/bold red] {command}. Use /help for a list of commands.")
+            console.print("[bold red]Error:[/bold red] Use '/search on' or '/search off'.")
+
+        if self.search_grounding != previous_grounding:
+            self.config["search_grounding"] = self.search_grounding
+            self._save_settings()
+            self.chat_session = self._create_new_chat() # Recreate chat to apply grounding tool
+
+        return False
+
+    async def _cmd_history(self, arg: str) -> bool:
+        """Clears the chat history."""
+        if arg.lower() == "clear":
+            # A pending append must not land after the file is truncated
+            await self._drain_writes()
+            self._roles = []
+            self._texts = []
+            self._contents_start = 0
+            self._contents_cache = []
+            rewrite_history(self._roles, self._texts)
+            self._persisted = 0
+            self._context_start = 0
+            self._context_tokens = 0
+            self.chat_session = self._create_new_chat()
+            console.print("[bold yellow]Chat history cleared.[/bold yellow] Chat session restarted.")
+        else:
+            console.print("[bold red]Error:[/bold red] Use '/history clear' to clear the conversation history.")
+
+        return False
+
+    async def _cmd_cache(self, arg: str) -> bool:
+        """Clears the response cache."""
+        if arg.lower() == "clear":
+            # Queue behind any pending cache store so it can't recreate an entry after the clear
+            self._schedule_write(clear_response_cache)
+            await self._drain_writes()
+            console.print("[bold yellow]Response cache cleared.[/bold yellow]")
+        else:
+            console.print("[bold red]Error:[/bold red] Use '/cache clear' to delete cached responses.")
 
         return False
 
-    def start_chat_loop(self):
+    async def _cmd_ask_many(self, arg: str) -> bool:
+        """Reads n prompts and sends them concurrently."""
+        try:
+            count = int(arg)
+        except ValueError:
+            count = 0
+        if count < 1:
+            console.print("[bold red]Error:[/bold red] Please specify how many prompts to send (e.g., /ask-many 3).")
+            return False
+
+        prompts = []
+        while len(prompts) < count:
+            prompt = ask_input(f"[bold cyan]Prompt {len(prompts) + 1}/{count}[/bold cyan]").strip()
+            if prompt:
+                prompts.append(prompt)
+
+        responses = await self.ask_many(prompts)
+        answered = [(prompt, response) for prompt, response in zip(prompts, responses) if response]
+        if answered:
+            # Only successful answers go into history, where they become context for later turns
+            for prompt, response in answered:
+                self._append_history("user", prompt)
+                self._append_history("model", response)
+            self._schedule_write(self._flush_history)
+            # The live session never saw these turns, so rebuild it from history
+            self.chat_session = self._create_new_chat()
+
+        return False
+
+    async def _with_retries(self, call, can_retry=lambda: True):
+        """Awaits call(), retrying transient API errors with exponential backoff."""
+        from google.genai.errors import APIError
+
+        for attempt in range(API_MAX_ATTEMPTS):
+            try:
+                return await call()
+            except APIError as e:
+                if e.code not in RETRYABLE_STATUS_CODES or attempt == API_MAX_ATTEMPTS - 1 or not can_retry():
+                    raise
+                await asyncio.sleep(2 ** attempt)
+
+    async def _stream_response(self, user_input: str, chunks: List[str]) -> str:
+        """Streams the answer to user_input to stdout, collecting the text in chunks."""
+        # The chat session supplies the model and prior turns; the config carries any /temp or /persona changes
+        response_stream = await self.chat_session.send_message_stream(user_input, config=self._generation_config())
+
+        # Chunks are often a few characters long, so write them straight to stdout and only
+        # flush on a newline or STREAM_FLUSH_INTERVAL after the first unflushed chunk
+        loop = asyncio.get_running_loop()
+        pending = []
+        flush_timer = None
+
+        def flush():
+            nonlocal flush_timer
+            if flush_timer is not None:
+                flush_timer.cancel()
+                flush_timer = None
+            if pending:
+                sys.stdout.write("".join(pending))
+                sys.stdout.flush()
+                pending.clear()
+
+        try:
+            async for chunk in response_stream:
+                if chunk.text:
+                    chunks.append(chunk.text)
+                    pending.append(chunk.text)
+                    if "\n" in chunk.text:
+                        flush()
+                    elif flush_timer is None:
+                        # A timer rather than a check on the next chunk, so text still shows during server pauses
+                        flush_timer = loop.call_later(STREAM_FLUSH_INTERVAL, flush)
+        finally:
+            # Show whatever arrived even if the stream fails partway
+            flush()
+        return "".join(chunks)
+
+    async def start_chat_loop(self):
         """The main interactive chat loop."""
-        
         # Display the prompt and a welcome message with settings
         self.display_settings()
-        
+
+        try:
+            await self._chat_loop()
+        except asyncio.CancelledError:
+            # Ctrl-C while awaiting the API cancels this task under asyncio.run instead of raising
+            # KeyboardInterrupt; treat it the same as Ctrl-C at the prompt
+            console.print("\n[bold green]Exiting Comp.lex.[/bold green]")
+        finally:
+            # Make sure background writes have landed, then persist anything left over
+            self._uncancel()
+            await self._drain_writes()
+            self._flush_history()
+
+    async def _chat_loop(self):
+        """Reads prompts and streams answers until the user exits."""
+        from google.genai.errors import APIError
+        from rich.panel import Panel
+
         while True:
             try:
-                user_input = Prompt.ask(f"\n[bold cyan]{os.getlogin()}@[/bold cyan][bold magenta]{self.model_name.split('-')[-1].upper()}[/bold magenta]").strip()
+                user_input = ask_input(self._prompt_str).strip()
                 
                 if not user_input:
                     continue
                 
                 if user_input.startswith("/"):
-                    if self.process_command(user_input):
+                    if await self.process_command(user_input):
                         break
                     continue
                 
-                # Add user message to history before sending
-                self.history.append({"role": "user", "text": user_input})
-
                 # Stream the response
                 console.print("\n[bold green]Comp.lex[/bold green]: ", end="")
-                full_response = ""
+                sys.stdout.flush()
                 
-                # Check which model to use based on grounding setting
-                model_to_use = "gemini-2.5-flash-lite" if self.search_grounding else self.model_name
-
-                # Start streaming process
-                response_stream = self.client.models.generate_content_stream(
-                    model=model_to_use,
-                    contents=[
-                        genai.types.Content(
-                            role="user",
-                            parts=[genai.types.Part.from_text(user_input)]
-                        )
-                    ],
-                    config={
-                        "system_instruction": self.system_instruction,
-                        "temperature": self.temperature,
-                        "tools": [{"google_search": {}}] if self.search_grounding else [],
-                    }
-                )
-                
-                for chunk in response_stream:
-                    if chunk.text:
-                        console.print(chunk.text, end="")
+                # Temperature 0 answers are deterministic, so a prompt repeated in the same context can be
+                # served from disk. Grounded answers depend on live search results and are never cached.
+                cache_key = None
+                if self.temperature == 0.0 and not self.search_grounding:
+                    # Key on the messages the session holds: the ones it was seeded with plus every turn since.
+                    # Its own Content list can't be used, as it splits each streamed answer by chunk.
+                    start = self._session_start
+                    context = zip(self._roles[start:], self._texts[start:])
+                    cache_key = response_cache_key(self.model_name, self.temperature, self.system_instruction, context, user_input)
+                    cached_response = load_cached_response(cache_key)
+                    if cached_response is not None:
+                        sys.stdout.write(cached_response)
                         sys.stdout.flush()
-                        full_response += chunk.text
+                        console.print()
+                        self._append_history("user", user_input)
+                        self._append_history("model", cached_response)
+                        self._schedule_write(self._flush_history)
+                        # The session never saw this turn, so rebuild it from history
+                        self.chat_session = self._create_new_chat()
+                        continue
+
+                # Retry transient failures, but not once part of the answer is already on screen
+                chunks = []
+                full_response = await self._with_retries(
+                    lambda: self._stream_response(user_input, chunks),
+                    can_retry=lambda: not chunks,
+                )
                 
                 # Print newline after streaming is complete
                 console.print()
 
-                # Save the model's full response and update history
+                # Record the turn only once it has an answer, so a failed prompt is never sent as context later
                 if full_response:
-                    self.history.append({"role": "model", "text": full_response})
-                    self.config["history"] = self.history
-                    save_config(self.config)
+                    self._append_history("user", user_input)
+                    self._append_history("model", full_response)
+                    self._schedule_write(self._flush_history)
+                    # The session keeps every turn it sends; restart it once the rolling window (message
+                    # count or token budget) has moved past the first message it holds
+                    if self._session_start < self._context_window_start():
+                        self.chat_session = self._create_new_chat()
+                    if cache_key is not None:
+                        self._schedule_write(store_cached_response, cache_key, full_response)
 
             except APIError as e:
                 console.print(Panel(
@@ -299,11 +843,123 @@ class ComplexChat:
                 break
             except Exception as e:
                 console.print(f"[bold red]An unexpected error occurred:[/bold red] {e}")
-                time.sleep(1)
+                await asyncio.sleep(1)
+
+
+    def run_batch(self, prompts: List[str]) -> List[Optional[str]]:
+        """Submits prompts as a single Gemini Batch API job; returns each answer, or None where it failed."""
+        model_to_use = "gemini-2.5-flash-lite" if self.search_grounding else self.model_name
+
+        # Each line of the input file is one independent GenerateContent request
+        with tempfile.NamedTemporaryFile("w", suffix=".jsonl", delete=False) as f:
+            for i, prompt in enumerate(prompts):
+                request = {
+                    "contents": [{"role": "user", "parts": [{"text": prompt}]}],
+                    "system_instruction": {"parts": [{"text": self.system_instruction}]},
+                    "generation_config": {"temperature": self.temperature},
+                    "tools": [{"google_search": {}}] if self.search_grounding else [],
+                }
+                f.write(json.dumps({"key": str(i), "request": request}) + "\n")
+            batch_file = Path(f.name)
+
+        try:
+            uploaded = self.client.files.upload(
+                file=str(batch_file),
+                config={"display_name": f"{APP_NAME}-batch", "mime_type": "jsonl"},
+            )
+        finally:
+            batch_file.unlink(missing_ok=True)
+
+        job = self.client.batches.create(
+            model=model_to_use,
+            src=uploaded.name,
+            config={"display_name": f"{APP_NAME}-batch"},
+        )
+        console.print(f"[bold green]Batch job submitted:[/bold green] {job.name} ({len(prompts)} prompts)")
+
+        try:
+            with console.status("[bold cyan]Waiting for batch job to finish...[/bold cyan]"):
+                while job.state.name not in BATCH_DONE_STATES:
+                    time.sleep(BATCH_POLL_INTERVAL)
+                    job = self.client.batches.get(name=job.name)
+        except KeyboardInterrupt:
+            # Don't leave an orphaned job running (and billing) on the server
+            self._cancel_batch(job.name)
+            return []
+
+        if job.state.name != "JOB_STATE_SUCCEEDED":
+            console.print(f"[bold red]Error:[/bold red] Batch job ended with state {job.state.name}.")
+            return []
+
+        # Results are not guaranteed to come back in submission order, so match them up by key
+        responses: List[Optional[str]] = [None] * len(prompts)
+        output = self.client.files.download(file=job.dest.file_name).decode("utf-8")
+        for line in output.splitlines():
+            if not line.strip():
+                continue
+            result = json.loads(line)
+            # Failed requests carry "error" instead of "response"; blocked ones have no candidates or content
+            candidates = result.get("response", {}).get("candidates") or [{}]
+            parts = (candidates[0].get("content") or {}).get("parts", [])
+            text = "".join(part.get("text", "") for part in parts)
+            if text:
+                responses[int(result["key"])] = text
+
+        # Only successful answers go into history; an empty model turn is rejected once sent back as context
+        for prompt, response in zip(prompts, responses):
+            if response:
+                self._append_history("user", prompt)
+                self._append_history("model", response)
+        self._flush_history()
+
+        return responses
+
+    def _cancel_batch(self, name: str):
+        """Cancels an interrupted batch job, or tells the user how to find it if that fails."""
+        from google.genai.errors import APIError
+
+        try:
+            self.client.batches.cancel(name=name)
+            console.print(f"\n[bold yellow]Batch job {name} cancelled.[/bold yellow]")
+        except APIError as e:
+            console.print(f"\n[bold red]Error:[/bold red] Could not cancel batch job {name}; it may still be running: {e}")
+
+
+def run_batch_file(chat_app: ComplexChat, path: Path):
+    """Reads one prompt per line from path and prints the batched answers."""
+    from google.genai.errors import APIError
+    from rich.markdown import Markdown
+
+    try:
+        prompts = [line.strip() for line in path.read_text().splitlines() if line.strip()]
+    except IOError as e:
+        console.print(f"[bold red]Error:[/bold red] Could not read batch file: {e}")
+        return
+
+    if not prompts:
+        console.print("[bold yellow]Warning:[/bold yellow] Batch file contains no prompts.")
+        return
+
+    try:
+        responses = chat_app.run_batch(prompts)
+    except APIError as e:
+        console.print(f"[bold red]API Error:[/bold red] The batch job could not be completed: [yellow]{e}[/yellow]")
+        return
+
+    for prompt, response in zip(prompts, responses):
+        console.print(f"\n[bold cyan]>[/bold cyan] {prompt}")
+        if response:
+            console.print(Markdown(response))
+        else:
+            console.print("[bold red]No response[/bold red] (the request failed or was blocked).")
 
 
 def main():
     """Main function to initialize and run the chat application."""
+    parser = argparse.ArgumentParser(prog="main.py", description=f"{APP_NAME} - Complex AI for the Command Line")
+    parser.add_argument("--batch", type=Path, metavar="PROMPTS_FILE", help="submit every line of PROMPTS_FILE as a single Gemini batch job")
+    args = parser.parse_args()
+
     console.print(f"[bold blue]Initializing {APP_NAME} CLI...[/bold blue]")
     
     config = load_config()
@@ -318,10 +974,17 @@ def main():
     # 2. Initialize and start the chat
     chat_app = ComplexChat(config)
     if chat_app.client:
-        chat_app.start_chat_loop()
+        if args.batch:
+            run_batch_file(chat_app, args.batch)
+        else:
+            try:
+                asyncio.run(chat_app.start_chat_loop())
+            except KeyboardInterrupt:
+                # A second Ctrl-C during shutdown escapes the loop; the save below still runs
+                console.print("\n[bold green]Exiting Comp.lex.[/bold green]")
     
-    # 3. Final save
-    save_config(chat_app.config)
+    # 3. Final save, skipped when every settings change has already been written
+    chat_app.save()
 
 if __name__ == "__main__":
     main()